@@ -1,13 +1,45 @@
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import csv
+import gc
+import os
 import re
-import json
+import shutil
 import time
+import orjson
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from phonetic_numba import NUMBA_AVAILABLE, PHON_TABLE, phonetic_series_jit
 
 # --- CONFIGURATION ---
 INPUT_FILE = "Sample_dataset.csv"      # Your raw data file
-OUTPUT_FILE = "companies_processed.json" # Output for Meilisearch
-BATCH_SIZE = 100000                  # Process in chunks to save memory
+OUTPUT_FILE = "companies_processed.ndjson" # Output for Meilisearch (one JSON document per line)
+BLOCK_SIZE = 64 << 20                # Bytes of CSV parsed per chunk (memory efficient)
+MAX_WORKERS = os.cpu_count() or 1    # Chunks are processed in parallel, one per process
+MAX_IN_FLIGHT = 2 * MAX_WORKERS      # Chunks queued at once; bounds memory use
+
+# Only these columns are read from the CSV; everything else is never decoded.
+# Text columns are pinned to string so a numeric-looking first block can't
+# fix the wrong type for the rest of the file.
+CSV_COLUMNS = {
+    'id': None,
+    'COMPANY_NAME': pa.string(),
+    'COMPANY_NAME_CLEANED': pa.string(),
+    'DOMAIN_NAME': pa.string(),
+    'DOMAIN_PART': pa.string(),
+    'SOURCE': pa.string(),
+    'EMPLOYEE_COUNT': pa.float64(),
+    'INDUSTRY_CAT_STD': pa.string(),
+    'COUNTRY': pa.string(),
+    'SIZE_DESC_STD': pa.string(),
+    'LAST_SEEN_DATE': pa.string(),
+    'DATE_LAST_VERIFIED': pa.string(),
+}
+
+# Collapses runs of the same character (e.g., "11" -> "1") in one regex pass
+_DUP_RE = re.compile(r'(.)\1+', re.DOTALL)
 
 # --- 1. CLEANING & TEXT PROCESSING FUNCTIONS ---
 
@@ -25,20 +57,41 @@ def clean_text_basic(text):
         pass
     return text.lower().strip()
 
+def clean_text_series(series):
+    """
+    Vectorized clean_text_basic for a whole column.
+    Non-string cells (None/NaN) become "" just like the scalar version.
+    """
+    return (series.astype('string')
+                  .str.encode('ascii', errors='ignore')
+                  .str.decode('ascii')
+                  .str.lower()
+                  .str.strip()
+                  .fillna(''))
+
 def get_ngrams(text, min_len=3, max_len=15):
     """
     Generates n-grams for partial matching (Tier 5).
     Input: "micro" -> ["mic", "micr", "micro"]
     """
-    if not text or not isinstance(text, str): 
-        return []
-    
     text = clean_text_basic(text)
-    if len(text) < min_len: 
-        return [text]
+    length = len(text)
+    if length < min_len: 
+        return [text] if text else []
     
     # Generate prefixes
-    return [text[:i] for i in range(min_len, min(len(text) + 1, max_len + 1))]
+    return [text[:i] for i in range(min_len, min(length, max_len) + 1)]
+
+def ngrams_series(cleaned, min_len=3, max_len=15):
+    """
+    get_ngrams for a column that already went through clean_text_series.
+    Loops over the raw object array, skipping the per-row Series wrapping of .apply.
+    """
+    return [
+        [text[:i] for i in range(min_len, min(length, max_len) + 1)] if length >= min_len
+        else ([text] if text else [])
+        for text, length in zip(cleaned.to_numpy(), cleaned.str.len().to_numpy())
+    ]
 
 def simple_phonetic(text):
     """
@@ -53,97 +106,135 @@ def simple_phonetic(text):
     if not text: 
         return ""
     
-    # 2. Keep first letter
+    # 2. Keep first letter, map the rest to sound groups (vowels removed)
     first = text[0]
-    remainder = text[1:]
-    
-    # 3. Phonetic Transformations
-    # Remove vowels
-    remainder = re.sub(r'[AEIOUY]', '', remainder)
-    # Map consonants to sound groups
-    remainder = re.sub(r'[BFPV]', '1', remainder)
-    remainder = re.sub(r'[CGJKQSXZ]', '2', remainder)
-    remainder = re.sub(r'[DT]', '3', remainder)
-    remainder = re.sub(r'[L]', '4', remainder)
-    remainder = re.sub(r'[MN]', '5', remainder)
-    remainder = re.sub(r'[R]', '6', remainder)
-    
-    # 4. Squeeze adjacent duplicates (e.g., "11" -> "1")
-    last_char = ""
-    reduced = ""
-    for char in remainder:
-        if char != last_char:
-            reduced += char
-        last_char = char
-        
-    return first + reduced
+    remainder = text[1:].translate(PHON_TABLE)
+    
+    # 3. Squeeze adjacent duplicates (e.g., "11" -> "1")
+    return first + _DUP_RE.sub(r'\1', remainder)
 
-def calc_quality_score(row):
+def phonetic_series(cleaned):
+    """
+    Vectorized simple_phonetic for a column that already went through
+    clean_text_series.
+    """
+    upper = cleaned.str.upper()
+    remainder = upper.str[1:].str.translate(PHON_TABLE).str.replace(_DUP_RE, r'\1', regex=True)
+    return upper.str[:1] + remainder
+
+def _has_value(df, col):
+    """Boolean mask of non-null cells; all False when the column is missing."""
+    if col not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+    return df[col].notna().to_numpy()
+
+def calc_quality_score_vec(df):
     """
     Calculates a 'Metadata Quality Score' for Ranking (Tier 6).
     Replicates the logic of preferring rich, verified data.
+    Works on whole columns, returns one score per row.
     """
-    score = 0
-    
     # 1. Source Priority (PDL > BOMBORA > HGDATA)
-    src = str(row.get('SOURCE', '')).upper()
-    if 'PDL' in src: score += 20
-    elif 'BOMBORA' in src: score += 15
-    elif 'HGDATA' in src: score += 10
+    src = df['SOURCE'].astype('string').str.upper()
+    score = np.select(
+        [src.str.contains('PDL', regex=False, na=False),
+         src.str.contains('BOMBORA', regex=False, na=False),
+         src.str.contains('HGDATA', regex=False, na=False)],
+        [20, 15, 10],
+        default=0,
+    )
     
     # 2. Metadata Richness
-    if pd.notna(row.get('EMPLOYEE_COUNT')) and row.get('EMPLOYEE_COUNT') > 0: 
-        score += 10
-    if pd.notna(row.get('INDUSTRY_CAT_STD')): 
-        score += 5
-    if pd.notna(row.get('COUNTRY')): 
-        score += 2
-    if pd.notna(row.get('SIZE_DESC_STD')): 
-        score += 3
-        
+    if 'EMPLOYEE_COUNT' in df.columns:
+        emps = pd.to_numeric(df['EMPLOYEE_COUNT'], errors='coerce').fillna(0)
+        score += 10 * emps.gt(0).to_numpy()
+    score += 5 * _has_value(df, 'INDUSTRY_CAT_STD')
+    score += 2 * _has_value(df, 'COUNTRY')
+    score += 3 * _has_value(df, 'SIZE_DESC_STD')
+    
     # 3. Recency / Verification
-    if pd.notna(row.get('LAST_SEEN_DATE')) or pd.notna(row.get('DATE_LAST_VERIFIED')):
-        score += 5
-        
+    score += 5 * (_has_value(df, 'LAST_SEEN_DATE') | _has_value(df, 'DATE_LAST_VERIFIED'))
+    
     return score
 
-def get_source_rank(source):
+def get_source_rank_vec(source):
     """Simple integer rank for sorting (Lower is better)"""
-    if not isinstance(source, str): return 99
-    src = source.upper()
-    if 'PDL' in src: return 1
-    if 'BOMBORA' in src: return 2
-    if 'HGDATA' in src: return 3
-    return 4
+    src = source.astype('string').str.upper()
+    return np.select(
+        [src.isna().to_numpy(),
+         src.str.contains('PDL', regex=False, na=False),
+         src.str.contains('BOMBORA', regex=False, na=False),
+         src.str.contains('HGDATA', regex=False, na=False)],
+        [99, 1, 2, 3],
+        default=4,
+    )
+
+def narrow_int_column(series, dtype='Int32'):
+    """
+    Casts a numeric column to a nullable int dtype when every value is a
+    whole number in range (e.g. 12.0 -> 12); otherwise returns it unchanged.
+    """
+    values = pd.to_numeric(series, errors='coerce')
+    present = values.dropna().to_numpy(dtype=np.float64)
+    info = np.iinfo(pd.api.types.pandas_dtype(dtype).numpy_dtype)
+    if ((present >= info.min) & (present <= info.max) & (present % 1 == 0)).all():
+        return values.astype(dtype)
+    return series
 
 # --- 2. MAIN PROCESSING PIPELINE ---
 
+def read_csv_batches(path):
+    """
+    Streams the CSV as Arrow record batches, decoding only CSV_COLUMNS.
+    Parsing is multithreaded C++; the header is read up front so optional
+    columns (DOMAIN_PART, id, ...) can be missing from the file.
+    """
+    with open(path, newline='') as f:
+        header = next(csv.reader(f))
+    
+    columns = [col for col in CSV_COLUMNS if col in header]
+    column_types = {col: CSV_COLUMNS[col] for col in columns if CSV_COLUMNS[col] is not None}
+    
+    return pa_csv.open_csv(
+        path,
+        read_options=pa_csv.ReadOptions(block_size=BLOCK_SIZE),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=columns,
+            column_types=column_types,
+            strings_can_be_null=True,
+        ),
+    )
+
 def process_chunk(chunk):
     """Processes a single chunk of the dataframe"""
     
     # 1. Basic Cleaning & ID
     # Use existing ID if present, otherwise we assume index handling outside
-    # Ensure NaN strings are handled
-    chunk = chunk.replace({np.nan: None})
+    # NaN handling happens once, in the final JSON clean below
 
     # 2. Text Normalization for Search Columns
-    chunk['company_name_cleaned_ascii'] = chunk['COMPANY_NAME_CLEANED'].apply(clean_text_basic)
+    chunk['company_name_cleaned_ascii'] = clean_text_series(chunk['COMPANY_NAME_CLEANED'])
     
     # 3. Tier 5: N-grams (Partial Match)
     # Use DOMAIN_PART if available, else derive from DOMAIN_NAME
     if 'DOMAIN_PART' not in chunk.columns:
-         chunk['DOMAIN_PART'] = chunk['DOMAIN_NAME'].astype(str).apply(lambda x: x.split('.')[0] if '.' in x else x)
+         chunk['DOMAIN_PART'] = chunk['DOMAIN_NAME'].astype('string').str.split('.', n=1).str[0]
     
-    chunk['domain_parts_ngram'] = chunk['DOMAIN_PART'].apply(get_ngrams)
+    domain_cleaned = clean_text_series(chunk['DOMAIN_PART'])
+    chunk['domain_parts_ngram'] = ngrams_series(domain_cleaned)
     
     # 4. Tier 4: Phonetics (Sound-alike)
     # Generate for both domain part and company name for max recall
-    chunk['domain_phonetic'] = chunk['DOMAIN_PART'].apply(simple_phonetic)
-    chunk['company_phonetic'] = chunk['COMPANY_NAME_CLEANED'].apply(simple_phonetic)
+    to_phonetic = phonetic_series_jit if NUMBA_AVAILABLE else phonetic_series
+    chunk['domain_phonetic'] = to_phonetic(domain_cleaned)
+    chunk['company_phonetic'] = to_phonetic(chunk['company_name_cleaned_ascii'])
     
     # 5. Tier 6: Ranking Logic
-    chunk['metadata_quality_score'] = chunk.apply(calc_quality_score, axis=1)
-    chunk['source_rank'] = chunk['SOURCE'].apply(get_source_rank)
+    # Both are small bounded ints (0-45, 1-99), so one byte per row is enough
+    chunk['metadata_quality_score'] = calc_quality_score_vec(chunk).astype(np.int8)
+    chunk['source_rank'] = get_source_rank_vec(chunk['SOURCE']).astype(np.int8)
+    if 'EMPLOYEE_COUNT' in chunk.columns:
+        chunk['EMPLOYEE_COUNT'] = narrow_int_column(chunk['EMPLOYEE_COUNT'])
     
     # 6. Tier 7: Alternative Names (Placeholders)
     # In production, you would merge your alt_names DataFrame here.
@@ -152,58 +243,86 @@ def process_chunk(chunk):
     chunk['alternative_phonetic'] = [[] for _ in range(len(chunk))]
     
     # 7. Final JSON Clean
-    # Convert dataframe to list of dicts, cleaning any non-serializable values
-    records = chunk.to_dict(orient='records')
-    cleaned_records = []
-    
-    for r in records:
-        clean_r = {}
-        for k, v in r.items():
-            # Filter out None/NaN values to save space, 
-            # Meilisearch treats missing fields as null anyway
-            if v is not None and v != "" and not (isinstance(v, float) and np.isnan(v)):
-                clean_r[k] = v
-        cleaned_records.append(clean_r)
+    # Mask NaN/None/empty strings in one pass instead of rebuilding every dict.
+    # They serialize as null, and Meilisearch treats null like a missing field.
+    # Columns that are empty for the whole chunk are dropped outright.
+    chunk = chunk.loc[:, chunk.notna().any()]
+    chunk = chunk.astype(object).where(chunk.notna() & chunk.ne(''), None)
+    
+    return chunk.to_dict(orient='records')
+
+def process_record_batch(batch, first_id, shard_path):
+    """
+    Worker entry point: converts one Arrow batch, runs process_chunk on it and
+    writes the records to its own shard file. Returns the number of records.
+    Module-level (no closures) so ProcessPoolExecutor can pickle it.
+    """
+    chunk = records = None
+    try:
+        chunk = batch.to_pandas()
         
-    return cleaned_records
+        # Add ID if missing (continuing the global counter from the main process)
+        if 'id' not in chunk.columns:
+            chunk.insert(0, 'id', range(first_id, first_id + len(chunk)))
+            
+        records = process_chunk(chunk)
+        with open(shard_path, 'wb') as f:
+            return write_records(f, records)
+    finally:
+        # Release the chunk before the worker picks up the next one (flat RSS)
+        del chunk, records
+        gc.collect()
+
+def write_records(f, records):
+    """Writes records as NDJSON (one object per line); returns the record count."""
+    for record in records:
+        f.write(orjson.dumps(record, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE))
+    return len(records)
+
+def merge_shards(shard_paths, output_path):
+    """
+    Concatenates the NDJSON shard files, in order, into output_path.
+    Written to a temp file and renamed, so output_path is never half-written.
+    """
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        for shard_path in shard_paths:
+            with open(shard_path, 'rb') as shard:
+                shutil.copyfileobj(shard, out)
+            os.remove(shard_path)
+    os.replace(tmp_path, output_path)
 
 def main():
     print(f"🚀 Starting Preprocessing for {INPUT_FILE}...")
     start_time = time.time()
     
-    # Load and Process in Chunks to handle large file size (memory efficient)
+    # Stream the file chunk by chunk: each worker flushes its chunk to a shard,
+    # so neither the records nor the output are ever held in memory at once
     processed_count = 0
+    written = 0
+    shard_paths = []
     
-    # Initialize output file (overwrite)
-    with open(OUTPUT_FILE, 'w') as f:
-        f.write('[') # Start JSON array
-    
-    first_chunk = True
-    
-    # Read CSV in chunks
-    for chunk in pd.read_csv(INPUT_FILE, chunksize=BATCH_SIZE, low_memory=False):
+    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        pending = deque()
         
-        # Add ID if missing (using global counter)
-        if 'id' not in chunk.columns:
-            chunk.insert(0, 'id', range(processed_count + 1, processed_count + 1 + len(chunk)))
+        # Read CSV in chunks, fan them out to the worker processes
+        for batch in read_csv_batches(INPUT_FILE):
+            shard_paths.append(f"{OUTPUT_FILE}.part{len(shard_paths)}")
+            pending.append(pool.submit(process_record_batch, batch, processed_count + 1, shard_paths[-1]))
+            processed_count += batch.num_rows
+            del batch
             
-        processed_data = process_chunk(chunk)
+            if len(pending) >= MAX_IN_FLIGHT:
+                written += pending.popleft().result()
+                print(f"   Processed {written:,} records...")
         
-        # Write to file incrementally
-        with open(OUTPUT_FILE, 'a') as f:
-            for i, record in enumerate(processed_data):
-                if not first_chunk or i > 0:
-                    f.write(',') # Separator between objects
-                json.dump(record, f)
-            
-        first_chunk = False
-        processed_count += len(chunk)
-        print(f"   Processed {processed_count:,} records...")
-        break
-
-    # Close JSON array
-    with open(OUTPUT_FILE, 'a') as f:
-        f.write(']')
+        # Drain the remaining chunks
+        while pending:
+            written += pending.popleft().result()
+            print(f"   Processed {written:,} records...")
+
+    # Shards are merged in read order so IDs stay sequential in the output
+    merge_shards(shard_paths, OUTPUT_FILE)
         
     elapsed = time.time() - start_time
     print(f"✅ DONE! Processed {processed_count:,} records in {elapsed:.1f} seconds.")
@@ -3,8 +3,10 @@ import json
 import logging
 import time
 import re
-from typing import List, Dict, Any, Optional
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
 from meilisearch_python_sdk import AsyncClient
+from meilisearch_python_sdk.models.search import SearchParams
 
 # Try to import meilisearch-python-sdk for async support
 # pip install meilisearch-python-sdk
@@ -19,6 +21,32 @@ from meilisearch_python_sdk import AsyncClient
 MEILI_URL = "http://localhost:7700" # Update for AWS (e.g., EC2 IP)
 MEILI_KEY = "testMasterKey123"
 INDEX_NAME = "companies"
+TEXT_CACHE_SIZE = 50_000 # Cleaned/phonetic strings kept across warm invocations
+MAX_CONCURRENT_SEARCHES = 64 # In-flight multi-search requests per batch (below httpx's 100-connection pool)
+
+# Phonetic mapping, identical to PHON_TABLE in 'phonetic_numba.py' (copied, not
+# imported: the lambda package ships without pandas/pyarrow).
+# Built once at import: vowels are dropped, consonants map to sound groups.
+_PHON_TABLE = str.maketrans({
+    **dict.fromkeys('AEIOUY'),
+    **dict.fromkeys('BFPV', '1'),
+    **dict.fromkeys('CGJKQSXZ', '2'),
+    **dict.fromkeys('DT', '3'),
+    'L': '4',
+    **dict.fromkeys('MN', '5'),
+    'R': '6',
+})
+_DUP_RE = re.compile(r'(.)\1+', re.DOTALL)
+
+# Base confidence for a hit, by the tier that found it
+TIER_BASE_SCORES = {
+    "Tier 1": 95,
+    "Tier 2": 90,
+    "Tier 7": 88,
+    "Tier 3": 80,
+    "Tier 4": 75,
+    "Tier 5": 70,
+}
 
 # Configure Logging
 logger = logging.getLogger()
@@ -26,6 +54,7 @@ logger.setLevel(logging.INFO)
 
 # --- HELPER FUNCTIONS ---
 
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
 def clean_text(text: str) -> str:
     """Standardize input text for matching."""
     if not text: return ""
@@ -37,6 +66,7 @@ def clean_text(text: str) -> str:
     except:
         return ""
 
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
 def get_phonetic(text: str) -> str:
     """
     Generate phonetic code (Simulated Metaphone).
@@ -47,23 +77,10 @@ def get_phonetic(text: str) -> str:
     if not text: return ""
     
     first = text[0]
-    remainder = text[1:]
-    remainder = re.sub(r'[AEIOUY]', '', remainder)
-    remainder = re.sub(r'[BFPV]', '1', remainder)
-    remainder = re.sub(r'[CGJKQSXZ]', '2', remainder)
-    remainder = re.sub(r'[DT]', '3', remainder)
-    remainder = re.sub(r'[L]', '4', remainder)
-    remainder = re.sub(r'[MN]', '5', remainder)
-    remainder = re.sub(r'[R]', '6', remainder)
+    remainder = text[1:].translate(_PHON_TABLE)
     
     # Remove adjacent duplicates
-    last = ""
-    reduced = ""
-    for char in remainder:
-        if char != last:
-            reduced += char
-        last = char
-    return first + reduced
+    return first + _DUP_RE.sub(r'\1', remainder)
 
 def get_ngrams(text: str, min_len=3) -> List[str]:
     """Generate n-grams for partial matching."""
@@ -74,52 +91,87 @@ def get_ngrams(text: str, min_len=3) -> List[str]:
     # For now, we will just search the full cleaning string against the array.
     return [text] 
 
+def score_hit(hit: Dict[str, Any]) -> float:
+    """
+    Score Calculation Logic (Replicating "DENSE_RANK").
+    Tier base score, boosted by metadata quality and company size, capped at 100.
+    """
+    # Start with Tier Base Score ("Tier 1 (Exact)" -> "Tier 1")
+    score = TIER_BASE_SCORES.get(hit['_match_tier'].split(' (')[0], 0)
+    
+    # Boost by Metadata Quality (0-40 pts)
+    quality = hit.get('metadata_quality_score', 0) or 0
+    score += (quality / 2) # Weighted boost
+    
+    # Boost by Size (Logarithmic boost)
+    emps = hit.get('EMPLOYEE_COUNT', 0) or 0
+    if emps > 10000: score += 10
+    elif emps > 1000: score += 5
+    
+    return min(score, 100) # Cap at 100
+
 # --- TIERED SEARCH LOGIC ---
 
 class CompanySearchEngine:
-    def __init__(self, url: str, key: str, index_name: str):
+    def __init__(self, url: str, key: str, index_name: str,
+                 max_concurrency: int = MAX_CONCURRENT_SEARCHES):
         self.url = url
         self.key = key
         self.index_name = index_name
+        # Caps in-flight requests so a 1000-name batch doesn't open 1000 sockets at once
+        self._semaphore = asyncio.Semaphore(max_concurrency)
 
-    async def _search_tier(self, index, query: str, tier_name: str, 
-                         search_params: Dict[str, Any]) -> List[Dict]:
-        """Generic async search wrapper for a specific tier."""
+    async def _search_tiers(self, client, tiers: List[Tuple[str, str, Dict[str, Any]]]) -> List[List[Dict]]:
+        """
+        Runs every tier query for a company in ONE multi-search request.
+        `tiers` is a list of (tier_name, query, search_params); returns the
+        tagged hits per tier, in the same order.
+        """
+        queries = [
+            SearchParams(
+                index_uid=self.index_name,
+                query=query,
+                # We explicitly ask for specific attributes to reduce payload size
+                attributes_to_retrieve=[
+                    'company_name_cleaned_ascii', 'DOMAIN_NAME', 'EMPLOYEE_COUNT', 
+                    'metadata_quality_score', 'source_rank'
+                ],
+                **search_params
+            )
+            for _, query, search_params in tiers
+        ]
+        
         try:
-            # We explicitly ask for specific attributes to reduce payload size
-            search_params['attributes_to_retrieve'] = [
-                'company_name_cleaned_ascii', 'DOMAIN_NAME', 'EMPLOYEE_COUNT', 
-                'metadata_quality_score', 'source_rank'
-            ]
-            
             # Execute Search
-            results = await index.search(query, **search_params)
-            
-            # Tag results with the Tier that found them
-            hits = results.hits 
+            results = await client.multi_search(queries)
+        except Exception as e:
+            logger.error(f"Error in multi-search for '{tiers[0][1]}': {str(e)}")
+            return [[] for _ in tiers]
+        
+        # Tag results with the Tier that found them
+        results_list = []
+        for (tier_name, _, _), result in zip(tiers, results):
+            hits = result.hits
             for hit in hits:
                 hit['_match_tier'] = tier_name
                 hit['_match_score'] = 0 # Will calculate later
-            return hits
-        except Exception as e:
-            logger.error(f"Error in {tier_name} for '{query}': {str(e)}")
-            return []
+            results_list.append(hits)
+        return results_list
 
-    async def search_company(self, client, raw_name: str) -> Dict[str, Any]:
+    async def search_company(self, client, raw_name: str, clean_name: str,
+                             phonetic_code: str) -> Dict[str, Any]:
         """
         Orchestrates the multi-tier parallel search for a SINGLE company name.
+        `clean_name`/`phonetic_code` are precomputed by process_batch, so the
+        coroutine only waits on Meilisearch.
         """
-        index = client.index(self.index_name)
-        clean_name = clean_text(raw_name)
-        phonetic_code = get_phonetic(clean_name)
-        
-        # --- DEFINE PARALLEL QUERIES ---
+        # --- DEFINE TIER QUERIES ---
         
-        tasks = []
+        tiers = []
 
         # Tier 1: Exact Match (High Confidence)
         # Search specifically in the cleaned name field
-        tasks.append(self._search_tier(index, clean_name, "Tier 1 (Exact)", {
+        tiers.append(("Tier 1 (Exact)", clean_name, {
             'attributes_to_search_on': ['company_name_cleaned_ascii', 'COMPANY_NAME'],
             'limit': 1,
             'matching_strategy': 'all' # Must match all words
@@ -127,14 +179,14 @@ class CompanySearchEngine:
 
         # Tier 2: Domain Part Exact (High Confidence)
         # Check if the input string matches a domain part exactly
-        tasks.append(self._search_tier(index, clean_name, "Tier 2 (Domain Exact)", {
+        tiers.append(("Tier 2 (Domain Exact)", clean_name, {
             'attributes_to_search_on': ['DOMAIN_PART'],
             'limit': 1
         }))
 
         # Tier 3: Typo Tolerant (Medium Confidence)
         # Standard Meilisearch behavior (allows typos)
-        tasks.append(self._search_tier(index, clean_name, "Tier 3 (Typo)", {
+        tiers.append(("Tier 3 (Typo)", clean_name, {
             'attributes_to_search_on': ['company_name_cleaned_ascii'],
             'limit': 3
         }))
@@ -142,32 +194,34 @@ class CompanySearchEngine:
         # Tier 4: Phonetic Match (Medium Confidence)
         # Search the pre-calculated phonetic codes
         if phonetic_code:
-            tasks.append(self._search_tier(index, phonetic_code, "Tier 4 (Phonetic)", {
+            tiers.append(("Tier 4 (Phonetic)", phonetic_code, {
                 'attributes_to_search_on': ['company_phonetic', 'domain_phonetic'],
                 'limit': 3
             }))
 
         # Tier 5: Partial/N-gram Match (Low/Medium Confidence)
         # Search against the n-gram array we built
-        tasks.append(self._search_tier(index, clean_name, "Tier 5 (N-gram)", {
+        tiers.append(("Tier 5 (N-gram)", clean_name, {
             'attributes_to_search_on': ['domain_parts_ngram'],
             'limit': 5
         }))
         
         # Tier 7: Alternative Names (High Confidence)
         # Search in the alt names array
-        tasks.append(self._search_tier(index, clean_name, "Tier 7 (Alt Names)", {
+        tiers.append(("Tier 7 (Alt Names)", clean_name, {
             'attributes_to_search_on': ['alternative_names'],
             'limit': 1
         }))
 
-        # --- EXECUTE ALL TIERS IN PARALLEL ---
+        # --- EXECUTE ALL TIERS IN ONE REQUEST ---
         
-        # asyncio.gather runs all search requests concurrently
-        results_list = await asyncio.gather(*tasks)
+        # multi-search sends every tier to Meilisearch in a single HTTP round-trip
+        async with self._semaphore:
+            results_list = await self._search_tiers(client, tiers)
         
         # --- AGGREGATE & RANK RESULTS ---
         
+        # Keep the best-scoring hit per domain, whichever tier found it
         all_candidates = {}
         
         for tier_hits in results_list:
@@ -175,33 +229,10 @@ class CompanySearchEngine:
                 domain = hit.get('DOMAIN_NAME')
                 if not domain: continue
                 
-                # If we've seen this domain, keep the higher tier priority? 
-                # Or just accumulate evidence.
-                # Here, we keep the first occurrence (since tiers are somewhat prioritized by logic)
-                if domain not in all_candidates:
+                hit['_match_score'] = score_hit(hit)
+                best = all_candidates.get(domain)
+                if best is None or hit['_match_score'] > best['_match_score']:
                     all_candidates[domain] = hit
-                    
-                    # Score Calculation Logic (Replicating "DENSE_RANK")
-                    # Start with Tier Base Score
-                    score = 0
-                    tier = hit['_match_tier']
-                    if "Tier 1" in tier: score = 95
-                    elif "Tier 2" in tier: score = 90
-                    elif "Tier 7" in tier: score = 88
-                    elif "Tier 3" in tier: score = 80
-                    elif "Tier 4" in tier: score = 75
-                    elif "Tier 5" in tier: score = 70
-                    
-                    # Boost by Metadata Quality (0-40 pts)
-                    quality = hit.get('metadata_quality_score', 0)
-                    score += (quality / 2) # Weighted boost
-                    
-                    # Boost by Size (Logarithmic boost)
-                    emps = hit.get('EMPLOYEE_COUNT', 0) or 0
-                    if emps > 10000: score += 10
-                    elif emps > 1000: score += 5
-                    
-                    hit['_match_score'] = min(score, 100) # Cap at 100
 
         # Sort candidates by calculated score
         sorted_candidates = sorted(
@@ -231,18 +262,38 @@ class CompanySearchEngine:
             "candidates_found": len(sorted_candidates)
         }
 
-    async def process_batch(self, company_names: List[str]) -> List[Dict]:
+    async def process_batch(self, client, company_names: List[str]) -> List[Dict]:
         """
         Process a list of 1000 names efficiently.
+        The caller owns 'client', so its connection pool survives across batches.
         """
-        async with AsyncClient(self.url, self.key) as client:
-            # Create a coroutine for each company name
-            tasks = [self.search_company(client, name) for name in company_names]
-            
-            # Execute all 1000 searches concurrently
-            # (Meilisearch handles high concurrency well, but we can chunk if needed)
-            results = await asyncio.gather(*tasks)
-            return results
+        # Normalize the whole batch up front (cached, CPU-only) before any I/O starts
+        clean_names = [clean_text(name) for name in company_names]
+        phonetic_codes = [get_phonetic(name) for name in clean_names]
+        
+        # Create a coroutine for each company name
+        tasks = [
+            self.search_company(client, raw_name, clean_name, phonetic_code)
+            for raw_name, clean_name, phonetic_code in zip(company_names, clean_names, phonetic_codes)
+        ]
+        
+        # Execute all 1000 searches concurrently
+        # (at most max_concurrency requests are in flight at any time)
+        results = await asyncio.gather(*tasks)
+        return results
+
+# --- WARM-START STATE ---
+# Lambda keeps module globals alive between invocations on the same container,
+# so the event loop and HTTP client (with its open connections) are reused.
+_LOOP = asyncio.new_event_loop()
+_CLIENT: Optional[AsyncClient] = None
+
+def get_client() -> AsyncClient:
+    """Create the shared Meilisearch client on first use."""
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = AsyncClient(MEILI_URL, MEILI_KEY)
+    return _CLIENT
 
 # --- MAIN LAMBDA HANDLER MOCK ---
 
@@ -262,9 +313,8 @@ def lambda_handler(event, context):
     # Initialize Engine
     engine = CompanySearchEngine(MEILI_URL, MEILI_KEY, INDEX_NAME)
     
-    # Run Async Loop
-    loop = asyncio.get_event_loop()
-    results = loop.run_until_complete(engine.process_batch(company_names))
+    # Run on the shared loop/client (no new TLS handshake on warm starts)
+    results = _LOOP.run_until_complete(engine.process_batch(get_client(), company_names))
     
     duration = time.time() - start_time
     print(f"✅ Finished in {duration:.2f} seconds.")
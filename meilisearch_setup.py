@@ -1,32 +1,78 @@
 import meilisearch
-import pandas as pd
+import asyncio
 import json
 import time
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from pandas.api.types import infer_dtype, is_object_dtype, is_string_dtype
+import orjson
 import os
+from concurrent.futures import ThreadPoolExecutor
+from meilisearch_python_sdk import AsyncClient
 
-def simple_clean(value):
-    """Simple cleaning - convert to basic Python types (used for CSV only)"""
-    if pd.isna(value):
-        return None
-    if isinstance(value, (int, bool)):
-        return value
-    if isinstance(value, float):
-        if pd.isna(value): return None
-        return value
-    if isinstance(value, str):
-        stripped = value.strip()
-        if not stripped: return None
-        try:
-            stripped = stripped.encode('ascii', errors='ignore').decode('ascii')
-        except:
-            pass
-        return stripped if stripped else None
-    return str(value) if value else None
+MEILI_URL = 'http://localhost:7700'
+MEILI_KEY = 'testMasterKey123'
+INDEXING_TIMEOUT_MS = 600_000  # Max wait for the document batches to be indexed
+WAIT_WORKERS = 4               # Batch tasks waited on concurrently
+UPLOAD_CONCURRENCY = 4         # Document batches POSTed at once (well under httpx's 100-connection pool)
+
+# Settings pushed around the bulk load. Searchable attributes and ranking rules
+# are set BEFORE loading (changing them later re-indexes everything); these
+# only toggle the per-batch extras. While loading, prefix and facet-search
+# databases are not rebuilt after every batch; the serve profile builds them
+# once at the end and turns typo tolerance back on for queries.
+BULK_SETTINGS = {
+    'prefixSearch': 'disabled',
+    'facetSearch': False,
+    'typoTolerance': {'enabled': False},
+}
+SERVE_SETTINGS = {
+    'prefixSearch': 'indexingTime',
+    'facetSearch': True,
+    'typoTolerance': {'enabled': True},
+}
+
+# Fields returned in search hits (the lambda's attributes_to_retrieve, plus the id)
+DISPLAYED_FIELDS = [
+    'id', 'company_name_cleaned_ascii', 'DOMAIN_NAME', 'EMPLOYEE_COUNT',
+    'metadata_quality_score', 'source_rank',
+]
+
+def ensure_ids(documents):
+    """
+    Numbers documents 1..N when they come without IDs. Files either carry IDs
+    on every document or on none, so the first document decides. Blank id
+    cells are written as null, so a null id counts as missing; existing IDs
+    are never overwritten.
+    """
+    if documents and documents[0].get('id') is None:
+        for i, doc in enumerate(documents, 1):
+            if doc.get('id') is None:
+                doc['id'] = i
+
+def clean_text_column(series):
+    """
+    Strips and drops non-ASCII from the str cells of an object/string column;
+    blanks and nulls become None. Other cells (e.g. the bools of a boolean
+    column with gaps, which loads as object) are kept as they are.
+    """
+    if infer_dtype(series, skipna=True) == 'string':
+        is_text = series.notna().to_numpy()
+    else:
+        is_text = series.map(type).eq(str).to_numpy()
+    
+    text = (series[is_text].astype('string')
+                           .str.strip()
+                           .str.encode('ascii', errors='ignore')
+                           .str.decode('ascii'))
+    cleaned = series.astype(object).where(series.notna(), None)
+    cleaned[is_text] = text.astype(object).where(text.ne(''), None).to_numpy()
+    return cleaned
 
 def load_data_file(file_path: str):
     """
-    Intelligently load either CSV or JSON file into a list of dictionaries (documents).
+    Intelligently load a CSV, JSON or NDJSON file into a list of dictionaries (documents).
     """
     print(f"📂 Loading {file_path}...")
     
@@ -43,49 +89,91 @@ def load_data_file(file_path: str):
         
         # Ensure IDs exist
         print("   Validating IDs...")
-        for i, doc in enumerate(documents):
-            if 'id' not in doc:
-                doc['id'] = i + 1
+        ensure_ids(documents)
         
         print(f"✅ Loaded {len(documents):,} documents from JSON")
         return documents
 
+    elif file_ext in ('ndjson', 'jsonl'):
+        # --- NDJSON PATH (output of data_preprocessing.py) ---
+        print("   Detected NDJSON format.")
+        with open(file_path, 'rb') as f:
+            documents = [orjson.loads(line) for line in f if line.strip()]
+        
+        # Ensure IDs exist
+        print("   Validating IDs...")
+        ensure_ids(documents)
+        
+        print(f"✅ Loaded {len(documents):,} documents from NDJSON")
+        return documents
+
     elif file_ext == 'csv':
         # --- CSV PATH ---
         print("   Detected CSV format.")
-        df = pd.read_csv(file_path, low_memory=False)
+        table = pa_csv.read_csv(
+            file_path,
+            convert_options=pa_csv.ConvertOptions(strings_can_be_null=True),
+        )
+        # pd.read_csv leaves dates as text; keep them that way (JSON has no date type)
+        for i, field in enumerate(table.schema):
+            if pa.types.is_temporal(field.type):
+                table = table.set_column(i, field.name, table.column(i).cast(pa.string()))
+        df = table.to_pandas(split_blocks=True, self_destruct=True)
+        del table
         print(f"✅ Loaded {len(df):,} rows x {len(df.columns)} columns")
 
-        # 2. Clean
+        # 2. Clean (vectorized per column)
+        # Text: strip + drop non-ASCII, '' -> None.
         print("🧹 Cleaning CSV data...")
         for col in df.columns:
-            df[col] = df[col].apply(simple_clean)
+            if is_object_dtype(df[col]) or is_string_dtype(df[col]):
+                df[col] = clean_text_column(df[col])
         
-        # 3. Handle NaNs
-        df = df.replace({np.nan: None})
-        df = df.where(pd.notna(df))
+        # Numeric: NaN/+-Inf -> None (JSON can't represent either), one isfinite
+        # over all numeric columns; only columns that have such values are touched
+        num_cols = df.select_dtypes(include='number').columns
+        finite = np.isfinite(df[num_cols].to_numpy(dtype='float64', na_value=np.nan))
+        dirty = ~finite.all(axis=0)
+        if dirty.any():
+            df[num_cols[dirty]] = df[num_cols[dirty]].astype(object).where(finite[:, dirty], None)
         
-        # 4. Add ID
+        # 3. Add ID
         if 'id' not in df.columns:
-            df.insert(0, 'id', range(1, len(df) + 1))
+            df.insert(0, 'id', np.arange(1, len(df) + 1, dtype=np.int64))
         
         documents = df.to_dict('records')
         
-        # 5. Sanitize
-        print("🔧 Sanitizing documents...")
-        for doc in documents:
-            for key in list(doc.keys()):
-                value = doc[key]
-                # Double check for lingering NaNs
-                if value is None: continue
-                if isinstance(value, float) and (np.isnan(value) or np.isinf(value)):
-                    doc[key] = None
-        
         print(f"✅ Converted to {len(documents):,} documents")
         return documents
 
     else:
-        raise ValueError(f"Unsupported file format: {file_ext}. Please use .csv or .json")
+        raise ValueError(f"Unsupported file format: {file_ext}. Please use .csv, .json or .ndjson")
+
+
+async def add_documents_async(index_name: str, documents, batch_size: int):
+    """
+    Queues the batches over the async client, UPLOAD_CONCURRENCY at a time, so
+    Meilisearch receives batches back to back instead of one HTTP round-trip
+    at a time. Returns the task uids in batch order.
+    """
+    async with AsyncClient(MEILI_URL, MEILI_KEY, timeout=30) as client:
+        index = client.index(index_name)
+        tasks = await index.add_documents_in_batches(
+            documents, batch_size=batch_size, concurrency_limit=UPLOAD_CONCURRENCY
+        )
+    return [task.task_uid for task in tasks]
+
+
+def wait_for_batches(index, task_uids):
+    """
+    Waits on every batch task concurrently, returns the finished tasks in
+    the same order as task_uids so each status can be checked per batch.
+    """
+    def wait(uid):
+        return index.wait_for_task(uid, timeout_in_ms=INDEXING_TIMEOUT_MS, interval_in_ms=1000)
+    
+    with ThreadPoolExecutor(max_workers=WAIT_WORKERS) as pool:
+        return list(pool.map(wait, task_uids))
 
 
 def setup_meilisearch(file_path: str):
@@ -96,7 +184,7 @@ def setup_meilisearch(file_path: str):
     
     # 2. Connect
     print("\n🔌 Connecting to Meilisearch...")
-    client = meilisearch.Client('http://localhost:7700', 'testMasterKey123', timeout=30)
+    client = meilisearch.Client(MEILI_URL, MEILI_KEY, timeout=30)
     
     # 3. Reset Index
     index_name = 'companies'
@@ -115,8 +203,6 @@ def setup_meilisearch(file_path: str):
     # 4. Configure Settings (Important for new columns!)
     print("🔍 Configuring searchable attributes...")
     
-    # Detect available columns from first document
-    sample_doc = documents[0] if documents else {}
     potential_fields = [
         'company_name_cleaned_ascii', 'COMPANY_NAME_CLEANED', 
         'COMPANY_NAME', 'DOMAIN_PART', 
@@ -126,12 +212,28 @@ def setup_meilisearch(file_path: str):
         'alternative_names'      # New from preprocessing
     ]
     
-    searchable = [field for field in potential_fields if field in sample_doc]
+    # Detect available columns across the documents: preprocessing drops a column
+    # that is empty for a whole chunk, so a single document can miss a field.
+    # Stop scanning as soon as every field we configure has been seen.
+    wanted = set(potential_fields) | set(DISPLAYED_FIELDS)
+    available = set()
+    for doc in documents:
+        available.update(doc)
+        if wanted <= available:
+            break
+    
+    searchable = [field for field in potential_fields if field in available]
     
     if searchable:
         task = index.update_searchable_attributes(searchable)
         print(f"   Searchable attributes set: {searchable}")
     
+    # Only return what 'lambda_search_engine.py' reads, keeping search responses small
+    displayed = [field for field in DISPLAYED_FIELDS if field in available]
+    if displayed:
+        index.update_displayed_attributes(displayed)
+        print(f"   Displayed attributes set: {displayed}")
+    
     # Configure Ranking Rules (Metadata boosting)
     print("🏆 Configuring ranking rules...")
     ranking_rules = [
@@ -141,37 +243,50 @@ def setup_meilisearch(file_path: str):
     ]
     index.update_ranking_rules(ranking_rules)
     
-    # 5. Load Documents (Async Batching)
-    print(f"\n📤 Loading {len(documents):,} documents...")
-    
-    batch_size = 10000
-    task_uids = []
-    
-    for i in range(0, len(documents), batch_size):
-        batch = documents[i:i+batch_size]
-        try:
-            task = index.add_documents(batch) # type: ignore
-            task_uids.append(task.task_uid)
-            if i % 50000 == 0:
-                print(f"   Queued batch {i // batch_size + 1}...")
-        except Exception as e:
-            print(f"❌ Error queuing batch {i}: {e}")
-
-    # 6. Wait for Completion
-    print(f"⏳ Waiting for processing ({len(task_uids)} batches)...")
-    
-    while True:
-        stats = index.get_stats()
-        count = stats.number_of_documents
-        if count >= len(documents) * 0.99:
-            print(f"\n✅ Indexing Complete! Total docs: {count:,}")
-            break
-        print(f"   Indexed: {count:,} / {len(documents):,}")
-        time.sleep(2)
+    # Lightweight profile while bulk loading
+    print("🚚 Applying bulk-load settings...")
+    index.update_settings(BULK_SETTINGS)
+    
+    # Steps 5-6 run under the bulk profile; the search profile is queued in
+    # 'finally' so a failed or timed-out load never leaves typo tolerance and
+    # prefix search switched off on the index
+    try:
+        # 5. Load Documents (Async Batching)
+        print(f"\n📤 Loading {len(documents):,} documents...")
+    
+        batch_size = 10000
+        task_uids = asyncio.run(add_documents_async(index_name, documents, batch_size))
+        print(f"   Queued {len(task_uids)} batches")
+
+        # 6. Wait for Completion
+        print(f"⏳ Waiting for processing ({len(task_uids)} batches)...")
+    
+        # Every batch is checked, not just the newest; failed batches are re-sent once
+        tasks = wait_for_batches(index, task_uids)
+        failed = [i for i, task in enumerate(tasks) if task.status != 'succeeded']
+        if failed:
+            print(f"⚠️  {len(failed)} batches failed, retrying once...")
+            for i in failed:
+                print(f"   Batch {i + 1} {tasks[i].status}: {tasks[i].error}")
+            retry_uids = [
+                index.add_documents(documents[i * batch_size:(i + 1) * batch_size]).task_uid
+                for i in failed
+            ]
+            for i, task in zip(failed, wait_for_batches(index, retry_uids)):
+                if task.status != 'succeeded':
+                    print(f"❌ Batch {i + 1} {task.status}: {task.error}")
+    finally:
+        # 7. Restore the search-time settings (one prefix/facet build for the whole load)
+        print("🔁 Applying search settings...")
+        settings_task = index.update_settings(SERVE_SETTINGS)
+    index.wait_for_task(settings_task.task_uid, timeout_in_ms=INDEXING_TIMEOUT_MS, interval_in_ms=1000)
+    
+    count = index.get_stats().number_of_documents
+    print(f"\n✅ Indexing Complete! Total docs: {count:,}")
         
     return index
 
 if __name__ == "__main__":
-    # Example usage: Can now pass CSV or JSON
+    # Example usage: Can now pass CSV, JSON or NDJSON
     # index = setup_meilisearch("companies_1M.csv") 
-    index = setup_meilisearch("companies_processed.json")
+    index = setup_meilisearch("companies_processed.ndjson")
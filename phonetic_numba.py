@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional; callers fall back to their str.translate path
+    njit = None
+
+NUMBA_AVAILABLE = njit is not None
+
+# --- PHONETIC LOOKUP TABLES ---
+# Phonetic mapping (Tier 4): vowels are dropped, consonants map to sound groups.
+# PHON_TABLE is the str.translate form used by the pure-Python paths, built once
+# at import so every call is a single C-level pass. PHON_LUT is the same mapping
+# as a 256-entry byte table: lowercase letters are folded to uppercase first,
+# other bytes map to themselves, PHON_DROP marks vowels.
+PHON_DROP = 255
+_PHON_CODES = {
+    **dict.fromkeys('AEIOUY', None),
+    **dict.fromkeys('BFPV', '1'),
+    **dict.fromkeys('CGJKQSXZ', '2'),
+    **dict.fromkeys('DT', '3'),
+    'L': '4',
+    **dict.fromkeys('MN', '5'),
+    'R': '6',
+}
+PHON_TABLE = str.maketrans(_PHON_CODES)
+UPPER_LUT = np.arange(256, dtype=np.uint8)
+UPPER_LUT[ord('a'):ord('z') + 1] -= 32
+PHON_LUT = UPPER_LUT.copy()
+for _char, _code in _PHON_CODES.items():
+    PHON_LUT[[ord(_char), ord(_char.lower())]] = PHON_DROP if _code is None else ord(_code)
+
+# --- KERNELS ---
+
+def encode_many(buf, offs, out_buf, out_lens, upper, lut):
+    """
+    simple_phonetic over Arrow string buffers, one forward pass per string.
+    Uppercases the first byte, maps the rest through lut (dropping PHON_DROP) and
+    skips a code equal to the previous emitted one. Writes each result at its
+    input offset in out_buf; it can only shrink.
+    """
+    for i in range(len(offs) - 1):
+        start = offs[i]
+        end = offs[i + 1]
+        if start == end:
+            out_lens[i] = 0
+            continue
+        out_buf[start] = upper[buf[start]]
+        n = 1
+        prev = PHON_DROP
+        for j in range(start + 1, end):
+            code = lut[buf[j]]
+            if code == PHON_DROP or code == prev:
+                continue
+            out_buf[start + n] = code
+            n += 1
+            prev = code
+        out_lens[i] = n
+
+def compact(out_buf, offs, out_lens, new_offs, packed):
+    """Packs the per-string results of encode_many into a contiguous buffer."""
+    for i in range(len(out_lens)):
+        src = offs[i]
+        dst = new_offs[i]
+        for k in range(out_lens[i]):
+            packed[dst + k] = out_buf[src + k]
+
+if NUMBA_AVAILABLE:
+    encode_many = njit(cache=True)(encode_many)
+    compact = njit(cache=True)(compact)
+
+def phonetic_series_jit(cleaned):
+    """
+    Vectorized simple_phonetic for an already-cleaned (ASCII, lowercase) column.
+    No Python object per row: the column is processed as one byte buffer plus offsets.
+    """
+    arr = pa.array(cleaned, type=pa.string(), from_pandas=True)
+    if isinstance(arr, pa.ChunkedArray):
+        arr = arr.combine_chunks()
+
+    _, offsets_buf, data_buf = arr.buffers()
+    offs = np.frombuffer(offsets_buf, dtype=np.int32)[arr.offset:arr.offset + len(arr) + 1]
+    buf = np.frombuffer(data_buf, dtype=np.uint8) if data_buf is not None else np.zeros(0, dtype=np.uint8)
+
+    out_buf = np.empty_like(buf)
+    out_lens = np.empty(len(arr), dtype=np.int32)
+    encode_many(buf, offs, out_buf, out_lens, UPPER_LUT, PHON_LUT)
+
+    new_offs = np.zeros(len(arr) + 1, dtype=np.int32)
+    np.cumsum(out_lens, out=new_offs[1:])
+    packed = np.empty(new_offs[-1], dtype=np.uint8)
+    compact(out_buf, offs, out_lens, new_offs, packed)
+
+    codes = pa.StringArray.from_buffers(len(arr), pa.py_buffer(new_offs), pa.py_buffer(packed))
+    return pd.Series(pd.arrays.ArrowExtensionArray(codes), index=cleaned.index)
@@ -1,11 +1,22 @@
+import gzip
 import meilisearch
+import queue
+import threading
 import pandas as pd
 import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyarrow.fs import S3FileSystem
 import boto3
-import io
+import requests
+from requests.adapters import HTTPAdapter
 import re
 import time
-import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from phonetic_numba import NUMBA_AVAILABLE, PHON_TABLE, phonetic_series_jit
 
 # --- CONFIGURATION ---
 MEILI_URL = 'http://localhost:7700'
@@ -22,6 +33,33 @@ AWS_REGION = 'us-east-1'
 # 51M records is huge, so we process in reasonably sized chunks.
 UPLOAD_BATCH_SIZE = 5000 
 
+# Low-cardinality text columns, read as dictionaries and handled as pandas
+# categoricals: string work runs once per category instead of once per row.
+CATEGORY_COLUMNS = ['SOURCE', 'INDUSTRY_CAT_STD', 'COUNTRY', 'SIZE_DESC_STD']
+
+# Only these fields are sent: searchable, filterable, ranking or read back by
+# 'lambda_search_engine.py'. Anything else would only slow indexing down.
+KEEP_COLUMNS = [
+    'id', 'company_name_cleaned_ascii', 'COMPANY_NAME', 'DOMAIN_NAME', 'DOMAIN_PART',
+    'domain_parts_ngram', 'domain_phonetic', 'company_phonetic',
+    'metadata_quality_score', 'EMPLOYEE_COUNT', 'COUNTRY', 'INDUSTRY_CAT_STD', 'SOURCE',
+]
+# Fields returned in search hits (the lambda's attributes_to_retrieve, plus the id)
+DISPLAYED_FIELDS = [
+    'id', 'company_name_cleaned_ascii', 'DOMAIN_NAME', 'EMPLOYEE_COUNT',
+    'metadata_quality_score', 'source_rank',
+]
+
+# Stages run concurrently: S3 reads, pandas processing and uploads overlap.
+READ_QUEUE_SIZE = 2      # Record batches read ahead of processing
+S3_IO_THREADS = 16       # Concurrent ranged GETs Arrow issues while pre-buffering a row group
+UPLOAD_WORKERS = 8       # Parallel document POSTs, one pooled keep-alive connection each
+MAX_IN_FLIGHT = 2 * UPLOAD_WORKERS  # Processed batches waiting to upload; bounds memory use
+GZIP_LEVEL = 3           # Upload bodies are gzipped; low levels already shrink JSON several-fold
+
+# Collapses runs of the same character (e.g., "11" -> "1") in one regex pass
+_DUP_RE = re.compile(r'(.)\1+', re.DOTALL)
+
 # --- 1. PREPROCESSING LOGIC (Preserved from your script) ---
 
 def clean_text_basic(text):
@@ -33,86 +71,154 @@ def clean_text_basic(text):
         pass
     return text.lower().strip()
 
+def clean_text_series(series):
+    """
+    Vectorized clean_text_basic for a whole column.
+    Non-string cells (None/NaN) become "" just like the scalar version.
+    """
+    return (series.astype('string')
+                  .str.encode('ascii', errors='ignore')
+                  .str.decode('ascii')
+                  .str.lower()
+                  .str.strip()
+                  .fillna(''))
+
 def get_ngrams(text, min_len=3, max_len=15):
     """Generates n-grams for partial matching."""
     if not text or not isinstance(text, str): return []
     text = clean_text_basic(text)
-    if len(text) < min_len: return [text]
+    if len(text) < min_len: return [text] if text else []
     return [text[:i] for i in range(min_len, min(len(text) + 1, max_len + 1))]
 
+def ngrams_series(cleaned, min_len=3, max_len=15):
+    """
+    get_ngrams for a column that already went through clean_text_series.
+    Every prefix length is one .str.slice over the whole column; each row then
+    keeps only the prefixes that fit inside its own length.
+    """
+    texts = cleaned.to_numpy(dtype=object)
+    if not len(texts):
+        return []
+    prefixes = np.stack([cleaned.str.slice(0, i).to_numpy(dtype=object)
+                         for i in range(min_len, max_len + 1)], axis=1)
+    counts = np.minimum(cleaned.str.len().to_numpy(), max_len) - min_len + 1
+    return [
+        row[:n].tolist() if n > 0 else ([text] if text else [])
+        for row, n, text in zip(prefixes, counts, texts)
+    ]
+
 def simple_phonetic(text):
     """Generates phonetic code."""
     if not text or not isinstance(text, str): return ""
     text = clean_text_basic(text).upper()
     if not text: return ""
     first = text[0]
-    remainder = re.sub(r'[AEIOUY]', '', text[1:])
-    remainder = re.sub(r'[BFPV]', '1', remainder)
-    remainder = re.sub(r'[CGJKQSXZ]', '2', remainder)
-    remainder = re.sub(r'[DT]', '3', remainder)
-    remainder = re.sub(r'[L]', '4', remainder)
-    remainder = re.sub(r'[MN]', '5', remainder)
-    remainder = re.sub(r'[R]', '6', remainder)
-    
-    reduced = ""
-    last_char = ""
-    for char in remainder:
-        if char != last_char:
-            reduced += char
-        last_char = char
-    return first + reduced
-
-def calc_quality_score(row):
-    """Calculates Metadata Quality Score."""
-    score = 0
-    src = str(row.get('SOURCE', '')).upper()
-    if 'PDL' in src: score += 20
-    elif 'BOMBORA' in src: score += 15
-    elif 'HGDATA' in src: score += 10
+    remainder = text[1:].translate(PHON_TABLE)
+    return first + _DUP_RE.sub(r'\1', remainder)
+
+def phonetic_series(cleaned):
+    """Vectorized simple_phonetic for a column that already went through clean_text_series."""
+    upper = cleaned.str.upper()
+    remainder = upper.str[1:].str.translate(PHON_TABLE).str.replace(_DUP_RE, r'\1', regex=True)
+    return upper.str[:1] + remainder
+
+def map_unique(func, cleaned):
+    """
+    Applies a column-wise func to the distinct values of cleaned only, then
+    broadcasts the results back by position. Names and domains repeat a lot,
+    so func sees far fewer rows than the batch has.
+    """
+    codes, uniques = pd.factorize(cleaned)
+    results = func(pd.Series(uniques, dtype='string')).to_numpy(dtype=object)
+    return pd.Series(results[codes], index=cleaned.index, dtype='string')
+
+def _has_value(df, col):
+    """Boolean mask of non-null cells; all False when the column is missing."""
+    if col not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+    return df[col].notna().to_numpy()
+
+def _source_contains(df, token):
+    """Boolean mask of rows whose upper-cased SOURCE contains token."""
+    if 'SOURCE' not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+    src = df['SOURCE']
+    if isinstance(src.dtype, pd.CategoricalDtype):
+        # Match the few categories once, then broadcast through the codes
+        # (code -1 = missing picks the trailing False)
+        hits = pd.Series(src.cat.categories).astype('string').str.upper().str.contains(token, regex=False)
+        return np.append(hits.to_numpy(dtype=bool), False)[src.cat.codes.to_numpy()]
+    return src.astype('string').str.upper().str.contains(token, regex=False).fillna(False).to_numpy(dtype=bool)
+
+def calc_quality_score_vec(df):
+    """Calculates Metadata Quality Score for every row at once."""
+    pdl = _source_contains(df, 'PDL')
+    bom = _source_contains(df, 'BOMBORA') & ~pdl
+    hg = _source_contains(df, 'HGDATA') & ~pdl & ~bom
     
-    if pd.notna(row.get('EMPLOYEE_COUNT')) and row.get('EMPLOYEE_COUNT') > 0: score += 10
-    if pd.notna(row.get('INDUSTRY_CAT_STD')): score += 5
-    if pd.notna(row.get('COUNTRY')): score += 2
-    if pd.notna(row.get('SIZE_DESC_STD')): score += 3
-    if pd.notna(row.get('LAST_SEEN_DATE')): score += 5
-    return score
+    emps = (pd.to_numeric(df['EMPLOYEE_COUNT'], errors='coerce').fillna(0).to_numpy() if 'EMPLOYEE_COUNT' in df.columns
+            else np.zeros(len(df)))
+    score = (20 * pdl + 15 * bom + 10 * hg
+             + 10 * (emps > 0)
+             + 5 * _has_value(df, 'INDUSTRY_CAT_STD')
+             + 2 * _has_value(df, 'COUNTRY')
+             + 3 * _has_value(df, 'SIZE_DESC_STD')
+             + 5 * _has_value(df, 'LAST_SEEN_DATE'))
+    return score.astype(np.int16)
 
 def process_dataframe(df):
-    """Applies all cleaning logic to a Pandas DataFrame."""
+    """Applies all cleaning logic to a Pandas DataFrame, returns an Arrow Table."""
     
-    # 1. Ensure ID exists. With 51M records, simple counters are risky across files.
+    # 1. Text Normalization
+    df['company_name_cleaned_ascii'] = clean_text_series(df['COMPANY_NAME_CLEANED'])
+    if 'DOMAIN_PART' not in df.columns:
+         # Missing domains become "" (dropped from the record) instead of the literal 'None'
+         df['DOMAIN_PART'] = (df['DOMAIN_NAME'].astype('string')
+                                               .str.split('.', n=1).str[0]
+                                               .fillna(''))
+
+    # 2. Ensure ID exists. With 51M records, simple counters are risky across files.
     # If your data has a UNIQUE ID in snowflake, use it. 
-    # Otherwise, generate a deterministic hash or UUID.
+    # Otherwise, hash name + full domain: stable across disjointed parquet files and
+    # re-ingests. Rows sharing both values get one id (the last upload wins), so
+    # the key uses DOMAIN_NAME, not DOMAIN_PART ('acme.com' and 'acme.de' differ).
+    # Rows with neither have nothing to key on and get a random id instead.
     if 'id' not in df.columns:
-        # Generating UUIDs to be safe across disjointed parquet files
-        df['id'] = [str(uuid.uuid4()) for _ in range(len(df))]
-
-    # 2. Text Normalization
-    df['company_name_cleaned_ascii'] = df['COMPANY_NAME_CLEANED'].apply(clean_text_basic)
+        name = df['COMPANY_NAME_CLEANED'].astype('string').fillna('')
+        domain = df['DOMAIN_NAME'].astype('string').fillna('')
+        ids = pd.util.hash_pandas_object(name + '|' + domain, index=False)
+        ids = ids.to_numpy(dtype=np.uint64, copy=True)
+        keyless = ((name == '') & (domain == '')).to_numpy(dtype=bool)
+        ids[keyless] = np.random.default_rng().integers(
+            np.iinfo(np.uint64).max, size=keyless.sum(), dtype=np.uint64, endpoint=True)
+        df['id'] = ids
     
     # 3. N-grams
-    if 'DOMAIN_PART' not in df.columns:
-         df['DOMAIN_PART'] = df['DOMAIN_NAME'].astype(str).apply(lambda x: x.split('.')[0] if '.' in x else x)
-    df['domain_parts_ngram'] = df['DOMAIN_PART'].apply(get_ngrams)
+    domain_cleaned = clean_text_series(df['DOMAIN_PART'])
+    df['domain_parts_ngram'] = ngrams_series(domain_cleaned)
     
-    # 4. Phonetics
-    df['domain_phonetic'] = df['DOMAIN_PART'].apply(simple_phonetic)
-    df['company_phonetic'] = df['COMPANY_NAME_CLEANED'].apply(simple_phonetic)
+    # 4. Phonetics (byte-level numba kernel when available, once per distinct value)
+    to_phonetic = phonetic_series_jit if NUMBA_AVAILABLE else phonetic_series
+    df['domain_phonetic'] = map_unique(to_phonetic, domain_cleaned)
+    df['company_phonetic'] = map_unique(to_phonetic, df['company_name_cleaned_ascii'])
     
     # 5. Ranking Scores
-    df['metadata_quality_score'] = df.apply(calc_quality_score, axis=1)
-    
-    # 6. Clean for JSON serialization (Handle NaN/Infinite)
-    df = df.replace({np.nan: None})
-    records = df.to_dict(orient='records')
+    df['metadata_quality_score'] = calc_quality_score_vec(df)
     
-    # Remove None keys to save network bandwidth
-    cleaned_records = []
-    for r in records:
-        clean_r = {k: v for k, v in r.items() if v is not None and v != ""}
-        cleaned_records.append(clean_r)
-        
-    return cleaned_records
+    # 6. Back to Arrow for serialization, keeping only the indexed fields:
+    # NaN/NA become nulls via the bitmap, blank strings are nulled too, and
+    # columns with no values at all are dropped
+    df = df[[col for col in KEEP_COLUMNS if col in df.columns]]
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(table.schema):
+        column = table.column(i)
+        if pa.types.is_dictionary(field.type):
+            # Categoricals are decoded here; the JSON body carries plain strings anyway
+            column = column.cast(field.type.value_type)
+        if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            table = table.set_column(i, field.name, pc.if_else(pc.not_equal(column, ''), column, None))
+    return table.select([name for name, column in zip(table.column_names, table.columns)
+                         if column.null_count < table.num_rows])
 
 # --- 2. MEILISEARCH SETUP ---
 
@@ -145,13 +251,79 @@ def init_meilisearch():
         # Facets for filtering
         index.update_filterable_attributes(['COUNTRY', 'INDUSTRY_CAT_STD', 'SOURCE'])
         
+        # Keep search responses small
+        index.update_displayed_attributes(DISPLAYED_FIELDS)
+        
     return client.index(INDEX_NAME)
 
 # --- 3. S3 & INGESTION PIPELINE ---
 
+def read_batches(file_keys, read_q):
+    """
+    Reader stage: streams every file's record batches into read_q, then None.
+    Ranged reads straight from S3, so only the batch being decoded is in memory.
+    """
+    fs = S3FileSystem(region=AWS_REGION)
+    try:
+        for idx, key in enumerate(file_keys):
+            print(f"\n⬇️  [{idx+1}/{len(file_keys)}] Streaming {key}...")
+            try:
+                with fs.open_input_file(f"{AWS_BUCKET}/{key}") as f:
+                    # The footer is read once; its metadata is reused for the reader below
+                    footer = pq.ParquetFile(f)
+                    columns = footer.schema_arrow.names
+                    # pre_buffer fetches a row group's column chunks as parallel ranged
+                    # GETs on Arrow's IO pool instead of one sequential read per column
+                    pf = pq.ParquetFile(f, metadata=footer.metadata, pre_buffer=True,
+                                        read_dictionary=[c for c in CATEGORY_COLUMNS if c in columns])
+                    print(f"   {pf.metadata.num_rows:,} rows in {pf.num_row_groups} row groups.")
+                    for batch_no, record_batch in enumerate(pf.iter_batches(batch_size=UPLOAD_BATCH_SIZE, use_threads=True), 1):
+                        read_q.put((f"{key} #{batch_no}", record_batch))
+            except Exception as e:
+                print(f"❌ Error reading {key}: {e}")
+    finally:
+        read_q.put(None)
+
+def make_session():
+    """
+    One requests.Session shared by all upload threads: keep-alive connections
+    are pooled, so batches don't pay a new TCP handshake each.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=UPLOAD_WORKERS, pool_maxsize=UPLOAD_WORKERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Authorization'] = f'Bearer {MEILI_KEY}'
+    return session
+
+def upload_batch(session, table, label):
+    """
+    Upload stage: sends one processed batch as NDJSON, returns the number of docs sent.
+    Null cells are left out of each document to save network bandwidth.
+    """
+    try:
+        # orjson writes numpy scalars and datetimes natively, far faster than stdlib json
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+        rows = table.to_pylist()
+        payload = b''.join(orjson.dumps({k: v for k, v in row.items() if v is not None}, option=option)
+                           for row in rows)
+        # zlib releases the GIL, so the upload threads compress in parallel
+        response = session.post(f"{MEILI_URL}/indexes/{INDEX_NAME}/documents",
+                                data=gzip.compress(payload, compresslevel=GZIP_LEVEL),
+                                headers={'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip'})
+        response.raise_for_status()
+        print(f"   Example: {rows[0].get('company_name_cleaned_ascii')}") # Debug print
+        print(f"   Sent batch {label} ({len(rows)} docs).")
+        return len(rows)
+    except Exception as e:
+        print(f"❌ Error uploading batch {label}: {e}")
+        # Optional: Retry logic here
+        time.sleep(5)
+        return 0
+
 def ingest_from_s3():
     s3 = boto3.client('s3', region_name=AWS_REGION)
-    index = init_meilisearch()
+    init_meilisearch()
     
     # List all parquet files
     print(f"📂 Listing files in s3://{AWS_BUCKET}/{AWS_PREFIX}...")
@@ -167,45 +339,35 @@ def ingest_from_s3():
     
     print(f"   Found {len(file_keys)} Parquet files.")
     
-    total_processed = 0
+    # S3 reads run in their own thread, ahead of processing
+    pa.set_io_thread_count(S3_IO_THREADS)
+    read_q = queue.Queue(maxsize=READ_QUEUE_SIZE)
+    reader = threading.Thread(target=read_batches, args=(file_keys, read_q), daemon=True)
+    reader.start()
     
-    for idx, key in enumerate(file_keys):
-        print(f"\n⬇️  [{idx+1}/{len(file_keys)}] Downloading {key}...")
-        
-        # Download file to memory buffer (Parquet is usually small enough per file)
-        # If individual files are >1GB, we need a different strategy.
-        obj = s3.get_object(Bucket=AWS_BUCKET, Key=key)
-        file_content = io.BytesIO(obj['Body'].read())
-        
-        # Read Parquet
-        try:
-            df = pd.read_parquet(file_content)
-            print(f"   Read {len(df):,} rows from Parquet.")
-        except Exception as e:
-            print(f"❌ Error reading {key}: {e}")
-            continue
-
-        # Process and Upload in Batches
-        # processing whole DF at once is faster for Vectorization, 
-        # but we split for Upload.
+    total_processed = 0
+    session = make_session()
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        pending = deque()
         
-        print("   Processing data (cleaning, phonetics)...")
-        # Process the whole dataframe in memory
-        documents = process_dataframe(df)
+        # Process batches as they arrive, fan the uploads out to the pool
+        while (item := read_q.get()) is not None:
+            label, record_batch = item
+            df = record_batch.to_pandas()
+            pending.append(pool.submit(upload_batch, session, process_dataframe(df), label))
+            del df, record_batch
+            
+            if len(pending) >= MAX_IN_FLIGHT:
+                total_processed += pending.popleft().result()
+                print(f"   Total: {total_processed:,}")
         
-        # Send to Meili in chunks
-        for i in range(0, len(documents), UPLOAD_BATCH_SIZE):
-            batch = documents[i : i + UPLOAD_BATCH_SIZE]
-            try:
-                index.add_documents(batch)
-                total_processed += len(batch)
-                print(f"   Example: {batch[0]['company_name_cleaned_ascii']}") # Debug print
-                print(f"   Sent batch {i//UPLOAD_BATCH_SIZE + 1} ({len(batch)} docs). Total: {total_processed:,}")
-            except Exception as e:
-                print(f"❌ Error uploading batch: {e}")
-                # Optional: Retry logic here
-                time.sleep(5)
-                
+        # Drain the remaining uploads
+        while pending:
+            total_processed += pending.popleft().result()
+            print(f"   Total: {total_processed:,}")
+    
+    session.close()
+    reader.join()
     print(f"\n✅ Ingestion Complete! Total documents sent: {total_processed:,}")
 
 if __name__ == "__main__":